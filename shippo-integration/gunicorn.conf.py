@@ -0,0 +1,27 @@
+"""
+Gunicorn config for the shipping dashboard (app.py) with Shippo webhooks
+
+    pip install gunicorn gevent
+    gunicorn -c gunicorn.conf.py app:app
+
+gevent lets one worker keep many webhook deliveries and iframe polls in flight
+while they wait on the network. SQLite calls don't yield: a query, or a batch
+applied by the Shippo writer (itself a greenlet once threading is patched),
+briefly blocks that worker. They are short because the writer batches
+webhooks into one transaction and reads hit indexes and the response cache.
+"""
+
+import multiprocessing
+
+bind = '0.0.0.0:5000'
+
+worker_class = 'gevent'
+# Each worker runs its own Shippo writer; their batches serialize on the
+# database's write lock (BEGIN IMMEDIATE, busy_timeout, retry on SQLITE_BUSY)
+workers = 2 * multiprocessing.cpu_count() + 1
+worker_connections = 1000
+keepalive = 30
+
+# Leave preload_app off: each worker must import the app after gevent has
+# patched it, so it starts its own Shippo writer and SQLite connections.
+preload_app = False
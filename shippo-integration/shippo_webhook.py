@@ -7,13 +7,52 @@ Handles:
 - transaction_updated: Label status changes
 - track_updated: Full tracking with addresses
 
+Webhooks are queued and written by a background thread in batches, one
+transaction per batch; handlers receive a cursor and never commit themselves.
+
+Deployment: runs under Flask's dev server, but for webhook bursts serve the
+app with gunicorn's gevent worker using the bundled gunicorn.conf.py:
+
+    pip install gunicorn gevent
+    gunicorn -c gunicorn.conf.py app:app
+
+Each worker process gets its own writer thread and one SQLite connection per
+OS thread (greenlets share it), plus a dedicated connection for the writer.
+Writers in different processes take turns on SQLite's write lock.
+
 Database table: shippo_tracking (separate from YoPrint shipments)
 """
 
+import atexit
+import functools
+import hashlib
+import itertools
 import json
 import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from enum import IntEnum
+from flask import Blueprint, Response, request, jsonify
+
+try:
+    import orjson
+except ImportError:  # optional - falls back to stdlib json
+    orjson = None
+
+try:
+    import redis
+except ImportError:  # optional - shared cache disabled without it
+    redis = None
+
+try:
+    from gevent import monkey as gevent_monkey
+except ImportError:  # only present when served by gunicorn's gevent worker
+    gevent_monkey = None
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +60,263 @@ logger = logging.getLogger(__name__)
 shippo_bp = Blueprint('shippo', __name__)
 
 
+def _json_dumps(obj):
+    """Compact JSON text via orjson when installed, else stdlib json"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _json_loads(raw):
+    """Parse JSON bytes via orjson when installed, else stdlib json"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+# Result cache for the read endpoints polled by the Missive iframe.
+# Level 1 is an in-process LRU; level 2 is Redis (set REDIS_URL) so every
+# worker process can share results. Cache keys embed a local version and a
+# shared Redis version, both bumped by invalidate_shippo_cache() after writes.
+CACHE_MAX_ENTRIES = 128
+CACHE_TTL_SECONDS = 30
+REDIS_KEY_PREFIX = 'shippo:api:'
+REDIS_VERSION_KEY = 'shippo:api-version'
+
+# Redis is only a cache, so calls get short timeouts; the shared version is
+# re-read at most once per REDIS_VERSION_TTL_SECONDS, and after a failure
+# Redis is skipped for REDIS_RETRY_AFTER_SECONDS.
+REDIS_SOCKET_TIMEOUT_SECONDS = 0.25
+REDIS_VERSION_TTL_SECONDS = 1
+REDIS_RETRY_AFTER_SECONDS = 30
+
+_cache = OrderedDict()
+_cache_version = 0
+_cache_lock = threading.Lock()
+
+_redis = None
+if redis is not None and os.environ.get('REDIS_URL'):
+    _redis = redis.Redis.from_url(
+        os.environ['REDIS_URL'],
+        socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT_SECONDS
+    )
+
+_shared_version = None
+_shared_version_expires = 0.0
+_redis_retry_at = 0.0
+
+
+def _redis_available():
+    """True if Redis is configured and not backing off after a failure"""
+    return _redis is not None and time.monotonic() >= _redis_retry_at
+
+
+def _redis_failed(action, e):
+    """Log a Redis error and skip Redis for REDIS_RETRY_AFTER_SECONDS"""
+    global _redis_retry_at
+    _redis_retry_at = time.monotonic() + REDIS_RETRY_AFTER_SECONDS
+    logger.warning(f"[SHIPPO] Redis {action} failed, retrying in {REDIS_RETRY_AFTER_SECONDS}s: {e}")
+
+
+def _redis_version():
+    """Shared cache version from Redis, or None if Redis is unavailable"""
+    global _shared_version, _shared_version_expires
+    if not _redis_available():
+        return None
+    now = time.monotonic()
+    if now < _shared_version_expires:
+        return _shared_version
+    try:
+        version = int(_redis.get(REDIS_VERSION_KEY) or 0)
+    except Exception as e:
+        _redis_failed('get version', e)
+        return None
+    _shared_version, _shared_version_expires = version, now + REDIS_VERSION_TTL_SECONDS
+    return version
+
+
+def _redis_key(key):
+    """Redis key for a cache key tuple: prefix + shared version + hashed args"""
+    digest = hashlib.blake2b(repr(key[2:]).encode(), digest_size=16).hexdigest()
+    return f'{REDIS_KEY_PREFIX}{key[1]}:{digest}'
+
+
+def _cache_key(*parts):
+    """Build a cache key for an endpoint and its query args"""
+    return (_cache_version, _redis_version()) + parts
+
+
+def _cache_get(key):
+    """Return cached JSON body for key, or None if missing/expired"""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            expires, body = entry
+            if expires >= time.monotonic():
+                _cache.move_to_end(key)
+                return body
+            del _cache[key]
+    
+    if key[1] is None or not _redis_available():
+        return None
+    try:
+        body = _redis.get(_redis_key(key))
+    except Exception as e:
+        _redis_failed('get', e)
+        return None
+    if body is not None:
+        _cache_put(key, body, shared=False)
+    return body
+
+
+def _cache_put(key, body, shared=True):
+    """Store JSON body for key, evicting least recently used entries"""
+    with _cache_lock:
+        _cache[key] = (time.monotonic() + CACHE_TTL_SECONDS, body)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    
+    if shared and key[1] is not None and _redis_available():
+        try:
+            _redis.setex(_redis_key(key), CACHE_TTL_SECONDS, body)
+        except Exception as e:
+            _redis_failed('set', e)
+
+
+def invalidate_shippo_cache():
+    """Drop cached API results - call after any write to shippo_tracking"""
+    global _cache_version, _shared_version, _shared_version_expires
+    with _cache_lock:
+        _cache_version += 1
+        _cache.clear()
+    
+    if _redis_available():
+        try:
+            version = _redis.incr(REDIS_VERSION_KEY)
+        except Exception as e:
+            _shared_version_expires = 0.0
+            _redis_failed('invalidate', e)
+        else:
+            _shared_version, _shared_version_expires = version, time.monotonic() + REDIS_VERSION_TTL_SECONDS
+
+
+# Webhook writes are queued and applied by one background thread so a burst
+# of deliveries shares a single transaction (and fsync) per batch.
+WRITE_BATCH_MAX = 200
+WRITE_BATCH_WINDOW_SECONDS = 0.05
+
+# Webhooks are acknowledged before they are written, so a batch that finds
+# the database busy or locked is retried with exponential backoff rather
+# than dropped. Any other error is logged and the batch skipped.
+WRITE_RETRY_ATTEMPTS = 10
+WRITE_RETRY_BACKOFF_SECONDS = 0.5
+WRITE_RETRY_BACKOFF_MAX_SECONDS = 30
+
+# How long interpreter exit waits for the writer to flush queued webhooks
+WRITER_SHUTDOWN_TIMEOUT_SECONDS = 30
+
+_write_queue = queue.Queue()
+_writer_thread = None
+
+# Delivered shipments older than this are moved to shippo_tracking_archive by
+# the writer thread (at startup, then daily) to keep the live table small.
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_INTERVAL_SECONDS = 24 * 60 * 60
+
+
+# Per-connection SQLite tuning. journal_mode=WAL is persistent in the database
+# file and set once in init_shippo_tables(); the rest must be set per connection.
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',  # 256 MB
+    'PRAGMA cache_size=-65536',    # 64 MB
+    'PRAGMA busy_timeout=5000',
+)
+
+
+def _apply_pragmas(conn):
+    """Apply SQLITE_PRAGMAS to a connection and return it"""
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# One long-lived connection per OS thread, so the page cache and statement
+# cache stay warm across requests. Under gevent, threading is monkey-patched
+# and threading.local becomes greenlet-local (one connection per request), so
+# the unpatched OS-thread local is used instead. Greenlets on one thread can
+# share a connection because sqlite3 calls never yield. Connections live in
+# the thread-local, so they are closed when their thread exits (e.g. under
+# Werkzeug's thread-per-request dev server) rather than accumulating.
+if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+    _os_thread_local = gevent_monkey.get_original('threading', 'local')
+else:
+    _os_thread_local = threading.local
+
+
+_tls = _os_thread_local()
+
+
+def _get_conn(get_db_func):
+    """Return this thread's pooled connection, opening it on first use"""
+    conn = getattr(_tls, 'conn', None)
+    if conn is None:
+        conn = _tls.conn = _apply_pragmas(get_db_func())
+    return conn
+
+
+@atexit.register
+def _close_pooled_conns():
+    """
+    Close the exiting thread's pooled connection at interpreter exit.
+    sqlite3 only lets a connection be closed by the thread that opened it;
+    other threads' connections are closed when those threads exit.
+    """
+    conn = getattr(_tls, 'conn', None)
+    if conn is not None:
+        _tls.conn = None
+        conn.close()
+
+
+class ShippoStatus(IntEnum):
+    """Shippo tracking statuses, stored in shippo_tracking.status_code"""
+    UNKNOWN = 0
+    PRE_TRANSIT = 1
+    TRANSIT = 2
+    DELIVERED = 3
+    RETURNED = 4
+    FAILURE = 5
+    ERROR = 6
+
+
+def status_code(status):
+    """Map a status string to its ShippoStatus (UNKNOWN if unrecognized)"""
+    return ShippoStatus.__members__.get(str(status).upper(), ShippoStatus.UNKNOWN)
+
+
+# Webhooks are written with INSERT ... ON CONFLICT DO UPDATE (UPSERT), which
+# SQLite added in 3.24.0; tracking_history is checked with the JSON1 functions.
+SQLITE_MIN_VERSION = (3, 24, 0)
+
+
+def _check_sqlite(conn):
+    """Raise RuntimeError if the linked SQLite lacks features this module uses"""
+    if sqlite3.sqlite_version_info < SQLITE_MIN_VERSION:
+        raise RuntimeError(
+            f"SQLite {'.'.join(map(str, SQLITE_MIN_VERSION))}+ required "
+            f"for shippo_tracking, found {sqlite3.sqlite_version}"
+        )
+    try:
+        conn.execute("SELECT json_valid('[]')")
+    except sqlite3.OperationalError:
+        raise RuntimeError(
+            f"SQLite {sqlite3.sqlite_version} was built without the JSON1 extension"
+        )
+
+
 def init_shippo_tables(db_connection_func):
     """
     Initialize Shippo tracking tables
@@ -30,6 +326,9 @@ def init_shippo_tables(db_connection_func):
         db_connection_func: Your get_db() function
     """
     conn = db_connection_func()
+    _check_sqlite(conn)
+    conn.execute('PRAGMA journal_mode=WAL')
+    _apply_pragmas(conn)
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -39,6 +338,7 @@ def init_shippo_tables(db_connection_func):
             tracking_number TEXT,
             carrier TEXT,
             status TEXT DEFAULT 'UNKNOWN',
+            status_code INTEGER,  -- ShippoStatus, used for filtering/grouping
             status_details TEXT,
             metadata TEXT,
             label_url TEXT,
@@ -62,7 +362,7 @@ def init_shippo_tables(db_connection_func):
             service_name TEXT,
             service_token TEXT,
             
-            -- Tracking history stored as JSON
+            -- Tracking history stored as a JSON array (validated on write)
             tracking_history TEXT,
             
             -- Timestamps
@@ -73,33 +373,303 @@ def init_shippo_tables(db_connection_func):
         )
     ''')
     
+    # Migrate tables created before status_code existed, then backfill it
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(shippo_tracking)')}
+    if 'status_code' not in columns:
+        cursor.execute('ALTER TABLE shippo_tracking ADD COLUMN status_code INTEGER')
+    cases = ' '.join(f"WHEN '{s.name}' THEN {s.value}" for s in ShippoStatus)
+    cursor.execute(f'''
+        UPDATE shippo_tracking
+        SET status_code = CASE UPPER(status) {cases} ELSE {ShippoStatus.UNKNOWN.value} END
+        WHERE status_code IS NULL
+    ''')
+    
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_shippo_tracking ON shippo_tracking(tracking_number)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shippo_status ON shippo_tracking(status)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_shippo_created ON shippo_tracking(created_at)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shippo_metadata ON shippo_tracking(metadata)')
+    # Serves status filter + created_at range + ORDER BY created_at DESC without a sort
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shippo_statuscode_created ON shippo_tracking(status_code, created_at DESC)')
+    # transaction_id is already indexed by its UNIQUE constraint.
+    # The TEXT status index is superseded by idx_shippo_statuscode_created, and
+    # metadata is only searched with a leading-% LIKE that no index can serve.
+    cursor.execute('DROP INDEX IF EXISTS idx_shippo_status')
+    cursor.execute('DROP INDEX IF EXISTS idx_shippo_metadata')
+    # tracking_history is served verbatim, so normalize anything that isn't a JSON array
+    cursor.execute('''
+        UPDATE shippo_tracking SET tracking_history = '[]'
+        WHERE tracking_history IS NOT NULL
+        AND CASE WHEN json_valid(tracking_history)
+                   THEN json_type(tracking_history) != 'array'
+                   ELSE 1 END
+    ''')
+    # Same columns, no constraints; filled by archive_old_rows(). Columns
+    # added to shippo_tracking since the archive was created are added here.
+    cursor.execute('CREATE TABLE IF NOT EXISTS shippo_tracking_archive AS SELECT * FROM shippo_tracking WHERE 0')
+    archive_columns = {row[1] for row in cursor.execute('PRAGMA table_info(shippo_tracking_archive)')}
+    for row in cursor.execute('PRAGMA table_info(shippo_tracking)').fetchall():
+        if row[1] not in archive_columns:
+            cursor.execute(f'ALTER TABLE shippo_tracking_archive ADD COLUMN {row[1]} {row[2]}')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shippo_archive_tracking ON shippo_tracking_archive(tracking_number)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shippo_archive_txn ON shippo_tracking_archive(transaction_id)')
+    
+    cursor.execute('ANALYZE shippo_tracking')
     
     conn.commit()
     conn.close()
     logger.info("Shippo tracking tables initialized")
 
 
+@functools.lru_cache(maxsize=4096)
 def detect_carrier(tracking_number):
     """Detect carrier from tracking number pattern"""
     if not tracking_number:
         return 'UNKNOWN'
-    tn = tracking_number.upper()
-    if tn.startswith('1Z'):
+    # Classify once up front instead of re-scanning / upper-casing the whole string
+    n = len(tracking_number)
+    prefix = tracking_number[:2].upper()
+    if prefix == '1Z':
         return 'UPS'
-    if len(tn) >= 12 and tn.isdigit():
-        return 'FEDEX'
-    if (len(tn) >= 16 and tn[0] == '9' and tn.isdigit()) or \
-       (len(tn) == 13 and tn[:2].isalpha() and tn[-2:] == 'US'):
+    if tracking_number.isdigit():
+        # All-digit 9xxx USPS numbers are >= 16 long, so FEDEX wins them first
+        if n >= 12:
+            return 'FEDEX'
+        if n in (10, 11):
+            return 'DHL'
+        return 'CARRIER'
+    if n == 13 and prefix.isalpha() and tracking_number[-2:].upper() == 'US':
         return 'USPS'
-    if len(tn) in [10, 11] and tn.isdigit():
-        return 'DHL'
     return 'CARRIER'
 
 
+def archive_old_rows(conn, days=ARCHIVE_AFTER_DAYS):
+    """
+    Move shipments delivered more than `days` ago into shippo_tracking_archive
+    
+    Args:
+        conn: Database connection (not inside an open transaction)
+        days: Age in days, by delivered_at, after which rows are archived
+    
+    Returns:
+        Number of rows archived
+    """
+    cutoff = f'-{int(days)} days'
+    cursor = conn.cursor()
+    # Copy by name: the two tables' column order differs once columns have
+    # been added to either one
+    columns = ', '.join(row[1] for row in cursor.execute('PRAGMA table_info(shippo_tracking)'))
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute(f'''
+            INSERT INTO shippo_tracking_archive ({columns})
+            SELECT {columns} FROM shippo_tracking
+            WHERE delivered_at IS NOT NULL
+            AND datetime(delivered_at) < datetime('now', ?)
+        ''', (cutoff,))
+        cursor.execute('''
+            DELETE FROM shippo_tracking
+            WHERE delivered_at IS NOT NULL
+            AND datetime(delivered_at) < datetime('now', ?)
+        ''', (cutoff,))
+        archived = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    if archived:
+        logger.info(f"[SHIPPO] Archived {archived} shipment(s) delivered over {days} days ago")
+        invalidate_shippo_cache()
+    return archived
+
+
+def _drain_write_queue(get_db_func):
+    """Writer thread loop: collect queued webhooks into batches and apply them"""
+    # The writer owns its connection so readers sharing an OS thread with it
+    # (gevent) never see an open write transaction.
+    conn = _apply_pragmas(get_db_func())
+    next_archive = time.monotonic()
+    stopping = False
+    while not stopping:
+        if time.monotonic() >= next_archive:
+            next_archive = time.monotonic() + ARCHIVE_INTERVAL_SECONDS
+            try:
+                archive_old_rows(conn)
+            except Exception as e:
+                logger.error(f"[SHIPPO] Archive failed: {e}", exc_info=True)
+        
+        try:
+            item = _write_queue.get(timeout=max(next_archive - time.monotonic(), 0))
+        except queue.Empty:
+            continue
+        if item is None:  # shutdown sentinel from _stop_writer()
+            break
+        batch = [item]
+        deadline = time.monotonic() + WRITE_BATCH_WINDOW_SECONDS
+        while len(batch) < WRITE_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _write_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        
+        _apply_with_retry(conn, _webhook_statements(batch))
+    conn.close()
+
+
+# Primary result codes for a database another connection holds
+_SQLITE_BUSY_CODES = (5, 6)  # SQLITE_BUSY, SQLITE_LOCKED
+
+
+def _is_busy(e):
+    """True if a sqlite3 error is SQLITE_BUSY / SQLITE_LOCKED, i.e. worth retrying"""
+    code = getattr(e, 'sqlite_errorcode', None)  # Python 3.11+
+    if code is not None:
+        return code & 0xff in _SQLITE_BUSY_CODES
+    return isinstance(e, sqlite3.OperationalError) and 'locked' in str(e)
+
+
+def _apply_with_retry(conn, statements):
+    """Apply statements, retrying busy/locked errors with backoff"""
+    delay = WRITE_RETRY_BACKOFF_SECONDS
+    for attempt in range(1, WRITE_RETRY_ATTEMPTS + 1):
+        try:
+            _apply_webhook_statements(conn, statements)
+            return
+        except sqlite3.Error as e:
+            if not _is_busy(e):
+                logger.error(f"[SHIPPO] Failed to apply {len(statements)} webhook(s): {e}", exc_info=True)
+                return
+            if attempt == WRITE_RETRY_ATTEMPTS:
+                logger.error(
+                    f"[SHIPPO] Giving up on {len(statements)} webhook(s) after "
+                    f"{attempt} attempts: {e}", exc_info=True
+                )
+                return
+            logger.warning(
+                f"[SHIPPO] Applying {len(statements)} webhook(s) failed ({e}), "
+                f"retrying in {delay:g}s"
+            )
+            time.sleep(delay)
+            delay = min(delay * 2, WRITE_RETRY_BACKOFF_MAX_SECONDS)
+        except Exception as e:
+            logger.error(f"[SHIPPO] Failed to apply {len(statements)} webhook(s): {e}", exc_info=True)
+            return
+
+
+def _webhook_statements(batch):
+    """Build (event, SQL, parameters) for each (event, data) webhook, skipping bad ones"""
+    statements = []
+    for event, data in batch:
+        try:
+            statements.append((event, *WEBHOOK_STATEMENTS[event](data)))
+        except Exception as e:
+            logger.error(f"[SHIPPO] Error handling {event}: {e}", exc_info=True)
+    return statements
+
+
+def _apply_webhook_batch(conn, batch):
+    """Apply a batch of (event, data) webhooks in one transaction"""
+    _apply_webhook_statements(conn, _webhook_statements(batch))
+
+
+def _apply_webhook_statements(conn, statements):
+    """
+    Apply (event, SQL, parameters) statements in one transaction.
+    Consecutive statements with the same SQL share one executemany()
+    call; runs are kept in arrival order so later events still win.
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        for (event, sql), items in itertools.groupby(statements, key=lambda item: item[:2]):
+            rows = [row for _, _, row in items]
+            _execute_rows(cursor, event, sql, rows)
+            if event in PLACEHOLDER_ADOPTING_EVENTS:
+                _adopt_placeholders(cursor, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    invalidate_shippo_cache()
+
+
+def _execute_rows(cursor, event, sql, rows):
+    """
+    executemany() rows, falling back to row-by-row so one bad row is skipped.
+    A busy or locked database is raised so the whole batch is retried instead.
+    """
+    cursor.execute('SAVEPOINT shippo_rows')
+    try:
+        cursor.executemany(sql, rows)
+    except sqlite3.Error as e:
+        if _is_busy(e):
+            raise
+        cursor.execute('ROLLBACK TO shippo_rows')
+        for row in rows:
+            try:
+                cursor.execute(sql, row)
+            except sqlite3.Error as e:
+                if _is_busy(e):
+                    raise
+                logger.error(f"[SHIPPO] Error handling {event}: {e}", exc_info=True)
+    cursor.execute('RELEASE shippo_rows')
+
+
+def _start_writer(get_db_func):
+    """Start the background webhook writer thread (once per process)"""
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    _writer_thread = threading.Thread(
+        target=_drain_write_queue,
+        args=(get_db_func,),
+        name='shippo-writer',
+        daemon=True
+    )
+    _writer_thread.start()
+
+
+# Registered after _close_pooled_conns, so it runs before it at exit
+@atexit.register
+def _stop_writer():
+    """Flush queued webhooks and stop the writer thread at interpreter exit"""
+    if _writer_thread is None or not _writer_thread.is_alive():
+        return
+    _write_queue.put(None)
+    _writer_thread.join(WRITER_SHUTDOWN_TIMEOUT_SECONDS)
+    if _writer_thread.is_alive():
+        logger.error(
+            f"[SHIPPO] Writer still busy after {WRITER_SHUTDOWN_TIMEOUT_SECONDS}s at exit, "
+            f"queued webhooks may be lost"
+        )
+
+
+# Columns returned by the list endpoint (what the Missive iframe renders)
+SHIPMENT_LIST_COLUMNS = (
+    'id, transaction_id, tracking_number, carrier, status, status_details, '
+    'metadata, label_url, tracking_url, eta, to_city, to_state, to_zip, '
+    'to_country, service_name, created_at, updated_at, delivered_at, '
+    'tracking_history'
+)
+
+
+def _shipment_json(row):
+    """
+    Serialize a shippo_tracking row to a JSON object string.
+    tracking_history is NULL until a track_updated arrives and otherwise a
+    JSON array (checked on write, normalized by init_shippo_tables), so it
+    is spliced in verbatim rather than parsed and re-serialized.
+    """
+    shipment = dict(row)
+    history = shipment.pop('tracking_history', None) or '[]'
+    return _json_dumps(shipment)[:-1] + ',"tracking_history":' + history + '}'
+
+
 def create_shippo_routes(get_db_func):
     """
     Create Shippo routes with database access
@@ -110,32 +680,32 @@ def create_shippo_routes(get_db_func):
     Returns:
         Blueprint with all Shippo routes
     """
+    _start_writer(get_db_func)
     
     @shippo_bp.route('/webhook/shippo', methods=['POST'])
     def shippo_webhook():
         """Receive Shippo webhooks"""
         try:
-            payload = request.get_json()
+            # Decode the raw body directly rather than through request.get_json()
+            raw = request.get_data()
+            payload = _json_loads(raw) if raw else None
             if not payload:
                 return jsonify({'error': 'No payload'}), 400
+            if not isinstance(payload, dict):
+                return jsonify({'error': 'Invalid payload'}), 400
             
             event = payload.get('event', 'unknown')
-            data = payload.get('data', {})
+            data = payload.get('data') or {}
+            if not isinstance(data, dict):
+                return jsonify({'error': 'Invalid payload'}), 400
             
             logger.info(f"[SHIPPO] Received webhook: {event}")
             
-            conn = get_db_func()
-            
-            if event == 'transaction_created':
-                handle_transaction_created(conn, data)
-            elif event == 'transaction_updated':
-                handle_transaction_updated(conn, data)
-            elif event == 'track_updated':
-                handle_track_updated(conn, data)
+            if event in WEBHOOK_STATEMENTS:
+                _write_queue.put((event, data))
             else:
                 logger.info(f"[SHIPPO] Unhandled event: {event}")
             
-            conn.close()
             return jsonify({'received': True}), 200
             
         except Exception as e:
@@ -151,19 +721,28 @@ def create_shippo_routes(get_db_func):
             days = int(request.args.get('days', 90))
             limit = int(request.args.get('limit', 200))
             
-            conn = get_db_func()
+            cache_key = _cache_key('shipments', status, search, days, limit)
+            cached = _cache_get(cache_key)
+            if cached is not None:
+                return Response(cached, mimetype='application/json')
+            
+            conn = _get_conn(get_db_func)
             cursor = conn.cursor()
             
             sql = f'''
-                SELECT * FROM shippo_tracking 
-                WHERE created_at >= datetime('now', '-{days} days')
-                AND status != 'ERROR'
+                SELECT {SHIPMENT_LIST_COLUMNS} FROM shippo_tracking 
+                WHERE created_at >= datetime('now', ?)
+                AND status_code != ?
             '''
-            params = []
+            params = [f'-{days} days', ShippoStatus.ERROR]
             
             if status and status.upper() != 'ALL':
-                sql += ' AND status = ?'
-                params.append(status.upper())
+                if status.upper() in ShippoStatus.__members__:
+                    sql += ' AND status_code = ?'
+                    params.append(ShippoStatus[status.upper()])
+                else:
+                    sql += ' AND status = ?'
+                    params.append(status.upper())
             
             if search:
                 sql += ''' AND (
@@ -181,26 +760,13 @@ def create_shippo_routes(get_db_func):
             cursor.execute(sql, params)
             rows = cursor.fetchall()
             
-            shipments = []
-            for row in rows:
-                shipment = dict(row)
-                # Parse tracking history JSON
-                if shipment.get('tracking_history'):
-                    try:
-                        shipment['tracking_history'] = json.loads(shipment['tracking_history'])
-                    except:
-                        shipment['tracking_history'] = []
-                else:
-                    shipment['tracking_history'] = []
-                shipments.append(shipment)
-            
-            conn.close()
-            
-            return jsonify({
-                'success': True,
-                'count': len(shipments),
-                'shipments': shipments
-            })
+            body = (
+                f'{{"success":true,"count":{len(rows)},"shipments":['
+                + ','.join(_shipment_json(row) for row in rows)
+                + ']}'
+            ).encode()
+            _cache_put(cache_key, body)
+            return Response(body, mimetype='application/json')
             
         except Exception as e:
             logger.error(f"[SHIPPO] API error: {e}", exc_info=True)
@@ -210,7 +776,7 @@ def create_shippo_routes(get_db_func):
     def get_shippo_shipment(shipment_id):
         """Get single shipment by ID or tracking number"""
         try:
-            conn = get_db_func()
+            conn = _get_conn(get_db_func)
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -219,19 +785,19 @@ def create_shippo_routes(get_db_func):
             ''', (shipment_id, shipment_id, shipment_id))
             
             row = cursor.fetchone()
-            conn.close()
+            if not row:
+                # Fall back to shipments moved out by archive_old_rows()
+                cursor.execute('''
+                    SELECT * FROM shippo_tracking_archive 
+                    WHERE tracking_number = ? OR transaction_id = ?
+                ''', (shipment_id, shipment_id))
+                row = cursor.fetchone()
             
             if not row:
                 return jsonify({'error': 'Not found'}), 404
             
-            shipment = dict(row)
-            if shipment.get('tracking_history'):
-                try:
-                    shipment['tracking_history'] = json.loads(shipment['tracking_history'])
-                except:
-                    shipment['tracking_history'] = []
-            
-            return jsonify({'success': True, 'shipment': shipment})
+            body = '{"success":true,"shipment":' + _shipment_json(row) + '}'
+            return Response(body, mimetype='application/json')
             
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -242,28 +808,34 @@ def create_shippo_routes(get_db_func):
         try:
             days = int(request.args.get('days', 90))
             
-            conn = get_db_func()
+            cache_key = _cache_key('stats', days)
+            cached = _cache_get(cache_key)
+            if cached is not None:
+                return Response(cached, mimetype='application/json')
+            
+            conn = _get_conn(get_db_func)
             cursor = conn.cursor()
             
-            cursor.execute(f'''
-                SELECT status, COUNT(*) as count
+            cursor.execute('''
+                SELECT status_code, COUNT(*) as count
                 FROM shippo_tracking 
-                WHERE created_at >= datetime('now', '-{days} days')
-                AND status != 'ERROR'
-                GROUP BY status
-            ''')
+                WHERE created_at >= datetime('now', ?)
+                AND status_code != ?
+                GROUP BY status_code
+            ''', (f'-{days} days', ShippoStatus.ERROR))
             
             rows = cursor.fetchall()
-            conn.close()
             
-            by_status = {row['status']: row['count'] for row in rows}
+            by_status = {ShippoStatus(row['status_code']).name: row['count'] for row in rows}
             total = sum(by_status.values())
             
-            return jsonify({
+            body = _json_dumps({
                 'success': True,
                 'total': total,
                 'by_status': by_status
-            })
+            }).encode()
+            _cache_put(cache_key, body)
+            return Response(body, mimetype='application/json')
             
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -271,175 +843,290 @@ def create_shippo_routes(get_db_func):
     return shippo_bp
 
 
-def handle_transaction_created(conn, data):
-    """Handle transaction_created webhook - new label"""
-    transaction_id = data.get('object_id')
-    tracking_number = data.get('tracking_number')
-    
-    logger.info(f"[SHIPPO] Transaction created: {transaction_id} - {tracking_number}")
+TRANSACTION_CREATED_SQL = '''
+    INSERT INTO shippo_tracking (
+        transaction_id, tracking_number, carrier, status, status_code, metadata,
+        label_url, tracking_url, eta, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(transaction_id) DO UPDATE SET
+        tracking_number = excluded.tracking_number,
+        status = excluded.status,
+        status_code = excluded.status_code,
+        metadata = COALESCE(excluded.metadata, metadata),
+        label_url = COALESCE(excluded.label_url, label_url),
+        tracking_url = COALESCE(excluded.tracking_url, tracking_url),
+        eta = COALESCE(excluded.eta, eta),
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+# Inserts like transaction_created if the label hasn't been seen yet
+TRANSACTION_UPDATED_SQL = '''
+    INSERT INTO shippo_tracking (
+        transaction_id, tracking_number, carrier, status, status_code, metadata,
+        label_url, tracking_url, eta, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(transaction_id) DO UPDATE SET
+        tracking_number = COALESCE(excluded.tracking_number, tracking_number),
+        carrier = COALESCE(shippo_tracking.carrier, excluded.carrier),
+        status = ?,
+        status_code = ?,
+        eta = COALESCE(excluded.eta, eta),
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+# A track_updated that arrives before its label is stored under a placeholder
+# 'track_<tracking_number>' row. Once a transaction with that tracking number
+# is written, the placeholder's tracking data is folded into it and the
+# placeholder deleted (see _adopt_placeholders).
+_PLACEHOLDER_MERGE_COLUMNS = (
+    'carrier', 'status_details', 'status_date', 'eta', 'to_name', 'to_city',
+    'to_state', 'to_zip', 'to_country', 'from_city', 'from_state', 'from_zip',
+    'from_country', 'service_name', 'service_token', 'tracking_history',
+    'delivered_at'
+)
+
+PLACEHOLDER_SELECT_SQL = f'''
+    SELECT status, status_code, {', '.join(_PLACEHOLDER_MERGE_COLUMNS)}
+    FROM shippo_tracking WHERE transaction_id = ?
+'''
+
+# Placeholder values are bound as ?1 status, ?2 status_code, then the merge
+# columns in order, and the transaction id last. A label's own status is only
+# UNKNOWN / PRE_TRANSIT, so the carrier's status from the placeholder wins
+# unless it is one of those too.
+_ADOPT_ASSIGNMENTS = ''.join(
+    f"{c} = COALESCE(NULLIF({c}, '[]'), ?{i}),\n        " if c == 'tracking_history'
+    else f'{c} = COALESCE({c}, ?{i}),\n        '
+    for i, c in enumerate(_PLACEHOLDER_MERGE_COLUMNS, start=3)
+)
+
+_LABEL_STATUS_CODES = f'({ShippoStatus.UNKNOWN.value}, {ShippoStatus.PRE_TRANSIT.value})'
+
+ADOPT_PLACEHOLDER_SQL = f'''
+    UPDATE shippo_tracking SET
+        status = CASE WHEN status_code IN {_LABEL_STATUS_CODES} AND ?2 NOT IN {_LABEL_STATUS_CODES}
+            THEN ?1 ELSE status END,
+        status_code = CASE WHEN status_code IN {_LABEL_STATUS_CODES} AND ?2 NOT IN {_LABEL_STATUS_CODES}
+            THEN ?2 ELSE status_code END,
+        {_ADOPT_ASSIGNMENTS}updated_at = CURRENT_TIMESTAMP
+    WHERE transaction_id = ?{len(_PLACEHOLDER_MERGE_COLUMNS) + 3}
+'''
+
+
+def _adopt_placeholders(cursor, rows):
+    """
+    Fold 'track_<n>' placeholder rows into just-written transaction rows.
     
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO shippo_tracking (
-            transaction_id, tracking_number, carrier, status, metadata,
-            label_url, tracking_url, eta, created_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(transaction_id) DO UPDATE SET
-            tracking_number = excluded.tracking_number,
-            status = excluded.status,
-            metadata = COALESCE(excluded.metadata, metadata),
-            label_url = COALESCE(excluded.label_url, label_url),
-            tracking_url = COALESCE(excluded.tracking_url, tracking_url),
-            eta = COALESCE(excluded.eta, eta),
-            updated_at = CURRENT_TIMESTAMP
-    ''', (
-        transaction_id,
+    Args:
+        cursor: Cursor inside the write transaction
+        rows: TRANSACTION_*_SQL parameter tuples (transaction_id, tracking_number, ...)
+    """
+    for transaction_id, tracking_number, *_ in rows:
+        if not tracking_number or not transaction_id:
+            continue
+        placeholder_id = f'track_{tracking_number}'
+        if transaction_id == placeholder_id:
+            continue
+        placeholder = cursor.execute(PLACEHOLDER_SELECT_SQL, (placeholder_id,)).fetchone()
+        if placeholder is None:
+            continue
+        cursor.execute(ADOPT_PLACEHOLDER_SQL, (*placeholder, transaction_id))
+        if cursor.rowcount:
+            cursor.execute('DELETE FROM shippo_tracking WHERE transaction_id = ?', (placeholder_id,))
+            logger.info(f"[SHIPPO] Merged {placeholder_id} into {transaction_id}")
+
+
+def _tracking_history_json(history):
+    """Serialize tracking_history for storage; anything but a list becomes []"""
+    if not isinstance(history, list):
+        return '[]'
+    try:
+        return _json_dumps(history)
+    except (TypeError, ValueError):
+        logger.warning("[SHIPPO] Unserializable tracking_history, storing []")
+        return '[]'
+
+
+# Payload keys copied straight into the SQL parameters, in column order.
+# Fetched with map(data.get, ...) so the lookups run in C rather than as
+# one Python-level .get() call each.
+_TRANSACTION_TAIL_FIELDS = ('metadata', 'label_url', 'tracking_url_provider', 'eta', 'object_created')
+_ADDRESS_TO_FIELDS = ('name', 'city', 'state', 'zip', 'country')
+_ADDRESS_FROM_FIELDS = ('city', 'state', 'zip', 'country')
+_SERVICE_FIELDS = ('name', 'token')
+
+
+def _transaction_row(data):
+    """Shared parameters for TRANSACTION_CREATED_SQL / TRANSACTION_UPDATED_SQL"""
+    get = data.get
+    tracking_number = get('tracking_number')
+    status = get('tracking_status', 'PRE_TRANSIT')
+    return (
+        get('object_id'),
         tracking_number,
         detect_carrier(tracking_number),
-        data.get('tracking_status', 'PRE_TRANSIT'),
-        data.get('metadata'),
-        data.get('label_url'),
-        data.get('tracking_url_provider'),
-        data.get('eta'),
-        data.get('object_created')
-    ))
-    conn.commit()
+        status,
+        status_code(status),
+        *map(get, _TRANSACTION_TAIL_FIELDS)
+    )
 
 
-def handle_transaction_updated(conn, data):
-    """Handle transaction_updated webhook - status change"""
-    transaction_id = data.get('object_id')
-    tracking_number = data.get('tracking_number')
-    
-    logger.info(f"[SHIPPO] Transaction updated: {transaction_id} - {data.get('tracking_status')}")
-    
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE shippo_tracking SET
-            tracking_number = COALESCE(?, tracking_number),
-            status = ?,
-            eta = COALESCE(?, eta),
-            updated_at = CURRENT_TIMESTAMP
-        WHERE transaction_id = ?
-    ''', (
-        tracking_number,
-        data.get('tracking_status', 'UNKNOWN'),
-        data.get('eta'),
-        transaction_id
-    ))
-    
-    # If no rows updated, insert new
-    if cursor.rowcount == 0:
-        handle_transaction_created(conn, data)
-    else:
-        conn.commit()
+def _transaction_created_row(data):
+    """Build TRANSACTION_CREATED_SQL parameters from a transaction_created payload"""
+    row = _transaction_row(data)
+    logger.info(f"[SHIPPO] Transaction created: {row[0]} - {row[1]}")
+    return row
 
 
-def handle_track_updated(conn, data):
-    """Handle track_updated webhook - has full address and tracking history"""
-    tracking_number = data.get('tracking_number')
-    transaction_id = data.get('transaction')
+def _transaction_updated_row(data):
+    """Build TRANSACTION_UPDATED_SQL parameters from a transaction_updated payload"""
+    row = _transaction_row(data)
+    logger.info(f"[SHIPPO] Transaction updated: {row[0]} - {data.get('tracking_status')}")
+    status = data.get('tracking_status', 'UNKNOWN')
+    return row + (status, status_code(status))
+
+
+# track_updated columns written for each optional payload key, with the
+# parameter extractor for them. A payload only writes the groups it carries,
+# so a status-only update doesn't rewrite addresses or history.
+_TRACK_OPTIONAL_COLUMNS = {
+    'eta': (
+        ('eta',),
+        lambda data: (data['eta'],)
+    ),
+    'address_to': (
+        ('to_name', 'to_city', 'to_state', 'to_zip', 'to_country'),
+        lambda data: tuple(map((data['address_to'] or {}).get, _ADDRESS_TO_FIELDS))
+    ),
+    'address_from': (
+        ('from_city', 'from_state', 'from_zip', 'from_country'),
+        lambda data: tuple(map((data['address_from'] or {}).get, _ADDRESS_FROM_FIELDS))
+    ),
+    'servicelevel': (
+        ('service_name', 'service_token'),
+        lambda data: tuple(map((data['servicelevel'] or {}).get, _SERVICE_FIELDS))
+    ),
+    'tracking_history': (
+        ('tracking_history',),
+        lambda data: (_tracking_history_json(data['tracking_history']),)
+    ),
+}
+_TRACK_CORE_COLUMNS = (
+    'tracking_number', 'carrier', 'status', 'status_code',
+    'status_details', 'status_date', 'delivered_at'
+)
+# Columns that keep their stored value when the update carries NULL
+_TRACK_COALESCE_COLUMNS = frozenset(('tracking_number', 'eta', 'to_name', 'delivered_at'))
+
+
+@functools.lru_cache(maxsize=None)
+def _track_updated_sql(present):
+    """
+    Generate the track_updated UPSERT for a tuple of present optional keys.
+    Without a transaction id, track_updated attaches to the row that already has
+    this tracking number (a real transaction before a placeholder), else creates
+    a 'track_<tracking_number>' row.
+    """
+    columns = _TRACK_CORE_COLUMNS + tuple(
+        column for key in present for column in _TRACK_OPTIONAL_COLUMNS[key][0]
+    )
+    assignments = ''.join(
+        f'{c} = COALESCE(excluded.{c}, {c}),\n        ' if c in _TRACK_COALESCE_COLUMNS
+        else f'{c} = excluded.{c},\n        '
+        for c in columns
+    ) + 'updated_at = CURRENT_TIMESTAMP'
+    return f'''
+    INSERT INTO shippo_tracking (
+        transaction_id, {', '.join(columns)}
+    ) VALUES (
+        COALESCE(?, (
+            SELECT transaction_id FROM shippo_tracking
+            WHERE tracking_number = NULLIF(?, '')
+            ORDER BY substr(transaction_id, 1, 6) = 'track_', id DESC
+            LIMIT 1
+        ), ?),
+        {', '.join('?' * len(columns))}
+    )
+    ON CONFLICT(transaction_id) DO UPDATE SET
+        {assignments}
+'''
+
+
+def _track_updated_statement(data):
+    """Build the (SQL, parameters) pair for a track_updated payload"""
+    get = data.get
+    tracking_number = get('tracking_number')
     
     logger.info(f"[SHIPPO] Track updated: {tracking_number}")
     
-    address_to = data.get('address_to', {})
-    address_from = data.get('address_from', {})
-    tracking_status = data.get('tracking_status', {})
-    service = data.get('servicelevel', {})
-    
-    cursor = conn.cursor()
-    
-    # Try to find existing record
-    if transaction_id:
-        cursor.execute('SELECT id FROM shippo_tracking WHERE transaction_id = ?', (transaction_id,))
+    tracking_status = get('tracking_status', {})
+    if isinstance(tracking_status, dict):
+        status = tracking_status.get('status', 'UNKNOWN')
+        status_details = tracking_status.get('status_details')
+        status_date = tracking_status.get('status_date')
     else:
-        cursor.execute('SELECT id FROM shippo_tracking WHERE tracking_number = ?', (tracking_number,))
-    
-    existing = cursor.fetchone()
+        status = str(tracking_status)
+        status_details = status_date = None
     
-    carrier = (data.get('carrier') or detect_carrier(tracking_number)).upper()
-    status = tracking_status.get('status', 'UNKNOWN') if isinstance(tracking_status, dict) else str(tracking_status)
+    carrier = (get('carrier') or detect_carrier(tracking_number)).upper()
+    code = status_code(status)
     
     # Check if delivered
-    delivered_at = None
-    if status == 'DELIVERED':
-        delivered_at = tracking_status.get('status_date') if isinstance(tracking_status, dict) else None
+    delivered_at = status_date if code == ShippoStatus.DELIVERED else None
     
-    if existing:
-        cursor.execute('''
-            UPDATE shippo_tracking SET
-                tracking_number = COALESCE(?, tracking_number),
-                carrier = ?,
-                status = ?,
-                status_details = ?,
-                status_date = ?,
-                eta = COALESCE(?, eta),
-                to_name = COALESCE(?, to_name),
-                to_city = ?,
-                to_state = ?,
-                to_zip = ?,
-                to_country = ?,
-                from_city = ?,
-                from_state = ?,
-                from_zip = ?,
-                from_country = ?,
-                service_name = ?,
-                service_token = ?,
-                tracking_history = ?,
-                delivered_at = COALESCE(?, delivered_at),
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (
-            tracking_number,
-            carrier,
-            status,
-            tracking_status.get('status_details') if isinstance(tracking_status, dict) else None,
-            tracking_status.get('status_date') if isinstance(tracking_status, dict) else None,
-            data.get('eta'),
-            address_to.get('name'),
-            address_to.get('city'),
-            address_to.get('state'),
-            address_to.get('zip'),
-            address_to.get('country'),
-            address_from.get('city'),
-            address_from.get('state'),
-            address_from.get('zip'),
-            address_from.get('country'),
-            service.get('name'),
-            service.get('token'),
-            json.dumps(data.get('tracking_history', [])),
-            delivered_at,
-            existing['id']
-        ))
-    else:
-        # Create new record
-        cursor.execute('''
-            INSERT INTO shippo_tracking (
-                transaction_id, tracking_number, carrier, status, status_details, status_date,
-                eta, to_city, to_state, to_zip, to_country,
-                from_city, from_state, from_zip, from_country,
-                service_name, service_token, tracking_history, delivered_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            transaction_id or f'track_{tracking_number}',
-            tracking_number,
-            carrier,
-            status,
-            tracking_status.get('status_details') if isinstance(tracking_status, dict) else None,
-            tracking_status.get('status_date') if isinstance(tracking_status, dict) else None,
-            data.get('eta'),
-            address_to.get('city'),
-            address_to.get('state'),
-            address_to.get('zip'),
-            address_to.get('country'),
-            address_from.get('city'),
-            address_from.get('state'),
-            address_from.get('zip'),
-            address_from.get('country'),
-            service.get('name'),
-            service.get('token'),
-            json.dumps(data.get('tracking_history', [])),
-            delivered_at
-        ))
-    
-    conn.commit()
+    present = tuple(key for key in _TRACK_OPTIONAL_COLUMNS if key in data)
+    row = (
+        get('transaction'),
+        tracking_number,
+        f'track_{tracking_number}',
+        tracking_number,
+        carrier,
+        status,
+        code,
+        status_details,
+        status_date,
+        delivered_at
+    )
+    for key in present:
+        row += _TRACK_OPTIONAL_COLUMNS[key][1](data)
+    return _track_updated_sql(present), row
+
+
+def _transaction_created_statement(data):
+    """Build the (SQL, parameters) pair for a transaction_created payload"""
+    return TRANSACTION_CREATED_SQL, _transaction_created_row(data)
+
+
+def _transaction_updated_statement(data):
+    """Build the (SQL, parameters) pair for a transaction_updated payload"""
+    return TRANSACTION_UPDATED_SQL, _transaction_updated_row(data)
+
+
+def handle_transaction_created(cursor, data):
+    """Handle transaction_created webhook - new label"""
+    sql, row = _transaction_created_statement(data)
+    cursor.execute(sql, row)
+    _adopt_placeholders(cursor, [row])
+
+
+def handle_transaction_updated(cursor, data):
+    """Handle transaction_updated webhook - status change"""
+    sql, row = _transaction_updated_statement(data)
+    cursor.execute(sql, row)
+    _adopt_placeholders(cursor, [row])
+
+
+def handle_track_updated(cursor, data):
+    """Handle track_updated webhook - has full address and tracking history"""
+    cursor.execute(*_track_updated_statement(data))
+
+
+# event -> (SQL, parameters) builder used by the batch writer
+WEBHOOK_STATEMENTS = {
+    'transaction_created': _transaction_created_statement,
+    'transaction_updated': _transaction_updated_statement,
+    'track_updated': _track_updated_statement,
+}
+
+# Events whose rows can take over a 'track_<n>' placeholder
+PLACEHOLDER_ADOPTING_EVENTS = frozenset(('transaction_created', 'transaction_updated'))
@@ -0,0 +1,290 @@
+"""
+Tests for shippo_webhook's SQLite writes
+
+Run from shippo-integration/:
+
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shippo_webhook as sw  # noqa: E402
+
+
+def _created(object_id, tracking_number, **extra):
+    return ('transaction_created', dict(
+        object_id=object_id, tracking_number=tracking_number,
+        object_created='2026-10-01 00:00:00', **extra
+    ))
+
+
+def _updated(object_id, tracking_number, status='TRANSIT'):
+    return ('transaction_updated', dict(
+        object_id=object_id, tracking_number=tracking_number,
+        tracking_status=status, object_created='2026-10-01 00:00:00'
+    ))
+
+
+def _track(tracking_number, status='TRANSIT', transaction=None, city='Lubbock'):
+    data = dict(
+        tracking_number=tracking_number,
+        tracking_status={'status': status, 'status_details': 'details'},
+        address_to={'city': city},
+        tracking_history=[{'status': status}],
+    )
+    if transaction:
+        data['transaction'] = transaction
+    return ('track_updated', data)
+
+
+class ShippoWebhookTestCase(unittest.TestCase):
+    """Base case with a fresh database file per test"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'shipping.db')
+
+    def get_db(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        self.addCleanup(conn.close)
+        return conn
+
+    def apply(self, *webhooks):
+        sw._apply_webhook_batch(self.conn, list(webhooks))
+
+    def rows(self):
+        return {
+            row['transaction_id']: row
+            for row in self.conn.execute('SELECT * FROM shippo_tracking')
+        }
+
+
+class TransactionKeyTests(ShippoWebhookTestCase):
+    """Placeholder rows and shared tracking numbers"""
+
+    def setUp(self):
+        super().setUp()
+        sw.init_shippo_tables(self.get_db)
+        self.conn = self.get_db()
+
+    def test_shared_tracking_numbers_stay_separate(self):
+        self.apply(
+            _created('a', 'SHIPPO_TRANSIT'), _created('b', 'SHIPPO_TRANSIT'),
+            _created('c', ''), _created('d', ''),
+        )
+        self.assertEqual(set(self.rows()), {'a', 'b', 'c', 'd'})
+
+    def test_track_before_created_is_adopted(self):
+        self.apply(_track('1Z555'))
+        self.assertEqual(set(self.rows()), {'track_1Z555'})
+
+        self.apply(_created('t5', '1Z555', metadata='SO 5'))
+        rows = self.rows()
+        self.assertEqual(set(rows), {'t5'})
+        self.assertEqual(rows['t5']['status'], 'TRANSIT')
+        self.assertEqual(rows['t5']['to_city'], 'Lubbock')
+        self.assertEqual(rows['t5']['metadata'], 'SO 5')
+
+    def test_track_before_update_of_label_without_tracking_number(self):
+        self.apply(_created('x', None))
+        self.apply(_track('T9', status='DELIVERED'))
+        self.apply(_updated('x', 'T9', status='TRANSIT'))
+        rows = self.rows()
+        self.assertEqual(set(rows), {'x'})
+        self.assertEqual(rows['x']['tracking_number'], 'T9')
+        self.assertEqual(rows['x']['to_city'], 'Lubbock')
+
+    def test_placeholder_adopted_within_one_batch(self):
+        self.apply(_track('1Z777'), _created('t7', '1Z777'), _track('1Z777', city='Waco'))
+        rows = self.rows()
+        self.assertEqual(set(rows), {'t7'})
+        self.assertEqual(rows['t7']['to_city'], 'Waco')
+
+    def test_bare_track_attaches_to_existing_transaction(self):
+        self.apply(_created('t1', '1Z999'))
+        self.apply(_track('1Z999', status='DELIVERED'))
+        rows = self.rows()
+        self.assertEqual(set(rows), {'t1'})
+        self.assertEqual(rows['t1']['status_code'], sw.ShippoStatus.DELIVERED)
+
+    def test_handlers_adopt_placeholders(self):
+        cursor = self.conn.cursor()
+        sw.handle_track_updated(cursor, _track('1Z888')[1])
+        sw.handle_transaction_created(cursor, _created('t8', '1Z888')[1])
+        self.conn.commit()
+        self.assertEqual(set(self.rows()), {'t8'})
+
+
+class TransactionUpdatedTests(ShippoWebhookTestCase):
+    """transaction_updated's status defaults when the payload has no tracking_status"""
+
+    def setUp(self):
+        super().setUp()
+        sw.init_shippo_tables(self.get_db)
+        self.conn = self.get_db()
+
+    def _updated_without_status(self, object_id):
+        return ('transaction_updated', {'object_id': object_id, 'tracking_number': '1Z1'})
+
+    def test_insert_defaults_to_pre_transit(self):
+        self.apply(self._updated_without_status('t1'))
+        row = self.rows()['t1']
+        self.assertEqual(row['status'], 'PRE_TRANSIT')
+        self.assertEqual(row['status_code'], sw.ShippoStatus.PRE_TRANSIT)
+
+    def test_update_defaults_to_unknown(self):
+        self.apply(_created('t1', '1Z1', tracking_status='TRANSIT'))
+        self.apply(self._updated_without_status('t1'))
+        row = self.rows()['t1']
+        self.assertEqual(row['status'], 'UNKNOWN')
+        self.assertEqual(row['status_code'], sw.ShippoStatus.UNKNOWN)
+
+
+class TrackUpdatedTests(ShippoWebhookTestCase):
+    """track_updated only writes the column groups its payload carries"""
+
+    def setUp(self):
+        super().setUp()
+        sw.init_shippo_tables(self.get_db)
+        self.conn = self.get_db()
+
+    def test_status_only_update_keeps_stored_columns(self):
+        full = _track('1Z999', transaction='t1')
+        full[1]['eta'] = '2026-10-20'
+        self.apply(full)
+        self.apply(('track_updated', {
+            'tracking_number': '1Z999',
+            'transaction': 't1',
+            'tracking_status': {'status': 'DELIVERED', 'status_date': '2026-10-19'},
+        }))
+
+        row = self.rows()['t1']
+        self.assertEqual(row['status_code'], sw.ShippoStatus.DELIVERED)
+        self.assertEqual(row['delivered_at'], '2026-10-19')
+        self.assertEqual(row['to_city'], 'Lubbock')
+        self.assertEqual(row['eta'], '2026-10-20')
+        self.assertEqual(json.loads(row['tracking_history']), [{'status': 'TRANSIT'}])
+
+
+class WriteRetryTests(ShippoWebhookTestCase):
+    """_apply_with_retry(): retry a busy database, skip anything else"""
+
+    def setUp(self):
+        super().setUp()
+        sw.init_shippo_tables(self.get_db)
+        self.conn = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(self.conn.close)
+
+    def test_busy_database_is_retried(self):
+        locker = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(locker.close)
+        locker.execute('BEGIN IMMEDIATE')
+
+        statements = sw._webhook_statements([_created('t1', '1Z1')])
+        with mock.patch('shippo_webhook.time.sleep', side_effect=lambda _: locker.rollback()) as sleep, \
+                self.assertLogs('shippo_webhook', 'WARNING'):
+            sw._apply_with_retry(self.conn, statements)
+        self.assertEqual(sleep.call_count, 1)
+        count = self.conn.execute('SELECT COUNT(*) FROM shippo_tracking').fetchone()[0]
+        self.assertEqual(count, 1)
+
+    def test_other_errors_are_not_retried(self):
+        self.conn.execute('DROP TABLE shippo_tracking')
+        statements = sw._webhook_statements([_created('t1', '1Z1')])
+        with mock.patch('shippo_webhook.time.sleep') as sleep, \
+                self.assertLogs('shippo_webhook', 'ERROR'):
+            sw._apply_with_retry(self.conn, statements)
+        sleep.assert_not_called()
+
+
+class InitTests(ShippoWebhookTestCase):
+    """init_shippo_tables() against existing databases"""
+
+    def test_init_with_shared_tracking_numbers(self):
+        conn = self.get_db()
+        conn.execute('''
+            CREATE TABLE shippo_tracking (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transaction_id TEXT UNIQUE NOT NULL,
+                tracking_number TEXT,
+                status TEXT DEFAULT 'UNKNOWN',
+                tracking_history TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                delivered_at TEXT
+            )
+        ''')
+        conn.executemany(
+            'INSERT INTO shippo_tracking (transaction_id, tracking_number) VALUES (?, ?)',
+            [('a', 'SHIPPO_TRANSIT'), ('b', 'SHIPPO_TRANSIT'), ('c', '1Z1'), ('track_1Z1', '1Z1')]
+        )
+        conn.commit()
+
+        sw.init_shippo_tables(self.get_db)
+        count = conn.execute('SELECT COUNT(*) FROM shippo_tracking').fetchone()[0]
+        self.assertEqual(count, 4)
+
+    def test_archive_created_before_status_code(self):
+        conn = self.get_db()
+        conn.execute('''
+            CREATE TABLE shippo_tracking (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transaction_id TEXT UNIQUE NOT NULL,
+                tracking_number TEXT,
+                status TEXT DEFAULT 'UNKNOWN',
+                tracking_history TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                delivered_at TEXT
+            )
+        ''')
+        conn.execute('CREATE TABLE shippo_tracking_archive AS SELECT * FROM shippo_tracking WHERE 0')
+        conn.execute('''
+            INSERT INTO shippo_tracking (transaction_id, status, delivered_at)
+            VALUES ('a', 'DELIVERED', '2020-01-01')
+        ''')
+        conn.commit()
+
+        sw.init_shippo_tables(self.get_db)
+        self.assertEqual(sw.archive_old_rows(conn), 1)
+        row = conn.execute('SELECT * FROM shippo_tracking_archive').fetchone()
+        self.assertEqual(row['transaction_id'], 'a')
+        self.assertEqual(row['status_code'], sw.ShippoStatus.DELIVERED)
+
+    def test_malformed_tracking_history_is_normalized(self):
+        sw.init_shippo_tables(self.get_db)
+        conn = self.get_db()
+        conn.executemany(
+            'INSERT INTO shippo_tracking (transaction_id, tracking_history) VALUES (?, ?)',
+            [('a', 'not json'), ('b', '{"a": 1}'), ('c', '[{"a": 1}]'), ('d', None)]
+        )
+        conn.commit()
+
+        sw.init_shippo_tables(self.get_db)
+        histories = {
+            row['transaction_id']: json.loads(sw._shipment_json(row))['tracking_history']
+            for row in conn.execute('SELECT * FROM shippo_tracking')
+        }
+        self.assertEqual(histories, {'a': [], 'b': [], 'c': [{'a': 1}], 'd': []})
+
+    def test_old_sqlite_is_rejected(self):
+        original = sw.SQLITE_MIN_VERSION
+        sw.SQLITE_MIN_VERSION = (99, 0, 0)
+        try:
+            with self.assertRaises(RuntimeError):
+                sw.init_shippo_tables(self.get_db)
+        finally:
+            sw.SQLITE_MIN_VERSION = original
+
+
+if __name__ == '__main__':
+    unittest.main()